@@ -1,10 +1,32 @@
 
+import copy
+import json
 import os
+import re
 import shutil
+import threading
 import zipfile
 import xml.etree.ElementTree as ET
 import xml.dom.minidom as minidom
 
+try:
+    from lxml import etree as LET
+except ImportError:  # lxml is optional; fall back to the standard library
+    LET = None
+
+try:
+    # zipfile defines ZIP_ZSTANDARD on every 3.14+ build, but it only works when
+    # Python was built with the zstd module
+    from compression import zstd  # noqa: F401
+    ZSTD_AVAILABLE = hasattr(zipfile, "ZIP_ZSTANDARD")
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasick is optional; fall back to a regex
+    ahocorasick = None
+
 # Compatibility adjustments for RimWorld 1.5
 REQUIRED_ATTRIBUTES = {
     "graphicData": """<graphicData>
@@ -13,6 +35,9 @@ REQUIRED_ATTRIBUTES = {
 </graphicData>"""
 }
 
+# No key may overlap another (one being a prefix, suffix or substring of another, or two
+# keys able to share characters in the text). The regex and Aho-Corasick matchers in
+# rewrite_changes() only agree on which match wins when matches never overlap.
 CHANGES = {
     "<renderNodeProperties>": "<graphicData>",
     "</renderNodeProperties>": "</graphicData>",
@@ -20,9 +45,127 @@ CHANGES = {
     "<drawNorthAfterHair>false</drawNorthAfterHair>": "<drawNorthAfterHair>true</drawNorthAfterHair>",
 }
 
-def create_incremental_zip(root_dir, target_dirs, zip_prefix, log):
+# CHANGES are source-level renames, so they are applied to the raw XML bytes in a single pass
+_CHANGES_BYTES = {old.encode("utf-8"): new.encode("utf-8") for old, new in CHANGES.items()}
+_CHANGES_RE = re.compile(b"|".join(re.escape(old) for old in _CHANGES_BYTES))
+
+# Below this many CHANGES the compiled regex is faster than walking automaton matches in Python
+AHOCORASICK_MIN_PATTERNS = 32
+
+_CHANGES_AUTOMATON = None
+if ahocorasick is not None and len(CHANGES) >= AHOCORASICK_MIN_PATTERNS:
+    # Matches every pattern in one scan however many CHANGES there are. Keys are stored
+    # as latin-1 text, which maps each byte to one character, so offsets are byte offsets.
+    _CHANGES_AUTOMATON = ahocorasick.Automaton()
+    for _old, _new in _CHANGES_BYTES.items():
+        _CHANGES_AUTOMATON.add_word(_old.decode("latin-1"), (_old, _new))
+    _CHANGES_AUTOMATON.make_automaton()
+
+# Used to repair malformed XML by joining all lines without their surrounding whitespace.
+# Any ASCII line break counts, including old Mac "\r" endings; non-ASCII whitespace such as
+# a no-break space is kept, since the bytes are never decoded.
+_LINE_BREAK_RE = re.compile(rb"\s*[\n\r\v\f]\s*")
+
+# Already-compressed formats are stored as-is; compressing them again only costs time
+STORED_EXTENSIONS = (".zip", ".png", ".jpg", ".jpeg", ".dds", ".ogg")
+
+if LET is not None:
+    # One recovering parser is shared by every parse; dropping whitespace-only
+    # text also lets pretty_print re-indent the whole tree. Recovery can silently drop
+    # content, so _parse_xml still treats any error it logged as a parse error.
+    PARSER = LET.XMLParser(recover=True, remove_blank_text=True)
+    PARSE_ERRORS = (ET.ParseError, LET.XMLSyntaxError)
+    etree = LET
+else:
+    PARSER = None
+    PARSE_ERRORS = (ET.ParseError,)
+    etree = ET
+
+# Parsed once; each file that needs an element gets its own copy
+_REQUIRED_ELEMENTS = {attr: etree.fromstring(value, PARSER) for attr, value in REQUIRED_ATTRIBUTES.items()}
+
+class _Log:
+    """
+    Update log that writes each message to the log file as soon as it is appended,
+    so memory stays flat and the log survives a crash.
+    """
+
+    def __init__(self, file_path):
+        self._file = open(file_path, "w", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+
+    def append(self, message):
+        with self._lock:
+            self._file.write(message + "\n")
+
+    def close(self):
+        self._file.close()
+
+def _open_archive(path, compresslevel=None):
+    """
+    Open a zip file for writing.
+    Without an explicit deflate level, Zstandard is preferred where Python supports it
+    (3.14+ built with zstd), falling back to the fastest deflate level.
+    """
+    if compresslevel is None:
+        if ZSTD_AVAILABLE:
+            return zipfile.ZipFile(path, "w", zipfile.ZIP_ZSTANDARD, compresslevel=3)
+        compresslevel = 1
+    return zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+
+def _read_file(file_path):
+    with open(file_path, "rb") as file:
+        return file.read()
+
+def collect_zip_entries(root_dir, target_dirs):
+    """
+    List (file_path, arcname) pairs for every file under the given folders, relative to root_dir.
+    Entries that name a single file are included as-is.
+    """
+    entries = []
+    for folder in target_dirs:
+        folder_path = os.path.join(root_dir, folder)
+        if os.path.isfile(folder_path):
+            entries.append((folder_path, folder))
+        elif os.path.exists(folder_path):
+            for root, _, files in os.walk(folder_path):
+                for file in files:
+                    file_path = os.path.join(root, file)
+                    entries.append((file_path, os.path.relpath(file_path, root_dir)))
+    return entries
+
+def write_files_to_zip(zip_file, entries):
+    """
+    Add (file_path, arcname) pairs to an open zip file.
+    Already-compressed formats are stored, everything else uses the archive's compression.
+    """
+    for file_path, arcname in entries:
+        if arcname.lower().endswith(STORED_EXTENSIONS):
+            zip_file.write(file_path, arcname, zipfile.ZIP_STORED)
+        else:
+            zip_file.write(file_path, arcname)
+
+def _manifest_path(root_dir, zip_prefix, revision):
+    return os.path.join(root_dir, f"{zip_prefix} rev {revision:02}.manifest.json")
+
+def load_manifest(root_dir, zip_prefix, revision):
+    """
+    Load the file manifest written alongside a delta zip, or an empty one if there is none.
+    """
+    try:
+        with open(_manifest_path(root_dir, zip_prefix, revision), "r", encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+
+def create_incremental_zip(root_dir, target_dirs, zip_prefix, log, compresslevel=None, delta=False):
     """
     Create an incremental zip file for backups or diagnostics.
+    Backups are short-lived, so the fastest available compression is used by default.
+
+    With delta=True, only files whose size or modification time changed since the previous
+    revision are stored. A manifest ("<prefix> rev NN.manifest.json") records which zip holds
+    each file, and "_delta.json" inside the zip lists the files inherited from earlier revisions.
     """
     revision = 0
     while os.path.exists(os.path.join(root_dir, f"{zip_prefix} rev {revision:02}.zip")):
@@ -31,16 +174,34 @@ def create_incremental_zip(root_dir, target_dirs, zip_prefix, log):
     zip_path = os.path.join(root_dir, zip_name)
 
     try:
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            for folder in target_dirs:
-                folder_path = os.path.join(root_dir, folder)
-                if os.path.exists(folder_path):
-                    for root, _, files in os.walk(folder_path):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            arcname = os.path.relpath(file_path, root_dir)
-                            zip_file.write(file_path, arcname)
+        entries = collect_zip_entries(root_dir, target_dirs)
+        manifest = {}
+        inherited = {}
+        if delta:
+            previous = load_manifest(root_dir, zip_prefix, revision - 1) if revision > 0 else {}
+            changed = []
+            for file_path, arcname in entries:
+                stat = os.stat(file_path)
+                record = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "zip": zip_name}
+                old = previous.get(arcname)
+                if old and old["mtime_ns"] == record["mtime_ns"] and old["size"] == record["size"]:
+                    record["zip"] = old["zip"]
+                    inherited[arcname] = old["zip"]
+                else:
+                    changed.append((file_path, arcname))
+                manifest[arcname] = record
+            entries = changed
+
+        with _open_archive(zip_path, compresslevel) as zip_file:
+            write_files_to_zip(zip_file, entries)
+            if inherited:
+                zip_file.writestr("_delta.json", json.dumps(inherited, indent=2))
             log.append(f"{zip_prefix} created successfully: {zip_path}")
+
+        if delta:
+            with open(_manifest_path(root_dir, zip_prefix, revision), "w", encoding="utf-8") as manifest_file:
+                json.dump(manifest, manifest_file, indent=2)
+            log.append(f"{len(entries)} changed file(s) stored, {len(inherited)} unchanged file(s) referenced from earlier revisions.")
     except Exception as e:
         log.append(f"Failed to create {zip_prefix} zip file: {e}")
 
@@ -56,89 +217,178 @@ def create_initial_backup(root_dir, log):
         return
 
     try:
-        with zipfile.ZipFile(initial_backup_path, "w", zipfile.ZIP_DEFLATED) as backup_zip:
-            for folder in ["1.4", "About"]:
-                folder_path = os.path.join(root_dir, folder)
-                if os.path.exists(folder_path):
-                    for root, _, files in os.walk(folder_path):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            arcname = os.path.relpath(file_path, root_dir)
-                            backup_zip.write(file_path, arcname)
+        with _open_archive(initial_backup_path) as backup_zip:
+            write_files_to_zip(backup_zip, collect_zip_entries(root_dir, ["1.4", "About"]))
             # Add README file for verification
-            readme_path = os.path.join(root_dir, "README.txt")
-            with open(readme_path, "w") as readme:
-                readme.write("This is the initial backup zip file created for safety purposes.")
-            backup_zip.write(readme_path, "README.txt")
-            os.remove(readme_path)  # Clean up README file
+            backup_zip.writestr("README.txt", "This is the initial backup zip file created for safety purposes.")
             log.append("Initial backup (backup.zip) created successfully.")
     except Exception as e:
         log.append(f"Failed to create initial backup: {e}")
 
+def link_or_copy(src, dst):
+    """
+    Hardlink src to dst, falling back to a real copy where links are unsupported
+    (e.g. FAT drives or different volumes).
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def replace_file(file_path, data):
+    """
+    Write data to a new file and move it over file_path.
+    Copied files may be hardlinks to the source, so they must never be rewritten in place.
+    """
+    temp_path = f"{file_path}.tmp"
+    try:
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        if os.path.exists(file_path):
+            # Keep the permissions an in-place rewrite would have kept
+            shutil.copymode(file_path, temp_path)
+        os.replace(temp_path, file_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
 def prettify_and_save(tree, file_path):
     """
     Save the XML tree to a file with refined pretty formatting.
     """
     try:
+        if LET is not None:
+            # Trees come from the shared blank-stripping PARSER, so lxml can pretty-print
+            # them directly in C without ever emitting blank lines
+            replace_file(file_path, LET.tostring(tree, pretty_print=True, xml_declaration=True, encoding="utf-8"))
+            return
+
         raw_str = ET.tostring(tree.getroot(), encoding="utf-8")
-        parsed_str = minidom.parseString(raw_str).toprettyxml(indent="  ")
+        # Asking minidom for bytes avoids decoding and re-encoding the whole document
+        parsed_str = minidom.parseString(raw_str).toprettyxml(indent="  ", encoding="utf-8")
 
         # Refine formatting: Remove excessive blank lines
-        refined_str = "\n".join([line for line in parsed_str.splitlines() if line.strip()])
+        refined_str = b"\n".join(line for line in parsed_str.split(b"\n") if line.strip())
 
         # Write the refined XML to the file
-        with open(file_path, "w", encoding="utf-8") as file:
-            file.write(refined_str + "\n")
+        replace_file(file_path, refined_str + b"\n")
     except Exception as e:
         raise RuntimeError(f"Failed to save refined XML for {file_path}: {e}")
 
-def validate_and_repair(file_path, log):
+def _parse_xml(file_path, data=None):
+    """
+    Parse an XML file (or its already-read bytes) with lxml when available,
+    otherwise with ElementTree.
+    """
+    if data is None:
+        tree = etree.parse(file_path, PARSER)
+    else:
+        root = etree.fromstring(data, PARSER)
+        tree = etree.ElementTree(root) if root is not None else None
+    if LET is not None:
+        errors = [error for error in PARSER.error_log if error.level >= LET.ErrorLevels.ERROR]
+        if errors:
+            error = errors[0]
+            raise ET.ParseError(f"{error.message}: line {error.line}, column {error.column}")
+    if tree is None or tree.getroot() is None:
+        # lxml's recovering parser returns an empty tree for unrecoverable input
+        raise ET.ParseError("no element found")
+    return tree
+
+def rewrite_changes(data):
+    """
+    Apply the CHANGES renames to raw XML bytes.
+    Returns the rewritten bytes and the set of original tags that were replaced.
+    """
+    replaced = set()
+
+    if _CHANGES_AUTOMATON is not None:
+        parts = []
+        cursor = 0
+        for end, (old, new) in _CHANGES_AUTOMATON.iter(data.decode("latin-1")):
+            start = end - len(old) + 1
+            if start < cursor:
+                continue  # overlaps a match that was already replaced
+            parts.append(data[cursor:start])
+            parts.append(new)
+            cursor = end + 1
+            replaced.add(old.decode("utf-8"))
+        parts.append(data[cursor:])
+        return b"".join(parts), replaced
+
+    def replace(match):
+        replaced.add(match.group(0).decode("utf-8"))
+        return _CHANGES_BYTES[match.group(0)]
+
+    return _CHANGES_RE.sub(replace, data), replaced
+
+def validate_and_repair(file_path, log, data=None):
     """
     Validate and attempt to repair malformed XML files.
+    If data is given it is parsed instead of the file's current contents.
     """
     try:
-        tree = ET.parse(file_path)
+        tree = _parse_xml(file_path, data)
         return tree
-    except ET.ParseError as e:
+    except PARSE_ERRORS as e:
         log.append(f"Parse error in {file_path}: {e}. Attempting repair...")
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                content = file.readlines()
-            cleaned_content = "".join(line.strip() for line in content)
-            with open(file_path, 'w', encoding='utf-8') as file:
-                file.write(cleaned_content)
-            tree = ET.parse(file_path)
+            if data is None:
+                data = _read_file(file_path)
+            # Strip the whitespace around every line break and at both ends of the file
+            cleaned_content = _LINE_BREAK_RE.sub(b"", data).strip()
+            # Only keep the repair if it parses; otherwise the file is left as it was
+            tree = _parse_xml(file_path, cleaned_content)
+            replace_file(file_path, cleaned_content)
             log.append(f"Repaired and parsed {file_path} successfully.")
             return tree
         except Exception as repair_error:
             log.append(f"Failed to repair {file_path}: {repair_error}")
             return None
 
-def apply_changes_with_refined_formatting(file_path, log):
+def apply_changes_with_refined_formatting(file_path, log, source_path=None):
     """
     Apply compatibility changes to an XML file with refined formatting.
+    If source_path is given, file_path is first created as a link or copy of it and the
+    source is read directly, so unchanged files cost no extra write.
     """
-    tree = validate_and_repair(file_path, log)
+    if source_path is not None:
+        try:
+            link_or_copy(source_path, file_path)
+        except OSError as e:
+            log.append(f"Failed to copy {source_path} to {file_path}: {e}")
+            return
+
+    try:
+        with open(source_path or file_path, "rb") as file:
+            data = file.read()
+    except OSError as e:
+        log.append(f"Failed to read {source_path or file_path}: {e}")
+        return
+
+    # Apply tag replacements to the source text before parsing
+    data, replaced = rewrite_changes(data)
+
+    tree = validate_and_repair(file_path, log, data)
     if tree is None:
         log.append(f"Skipping file due to persistent errors: {file_path}")
         return
 
     try:
         root = tree.getroot()
-        content_updated = False
+        content_updated = bool(replaced)
 
-        # Apply tag replacements
         for old, new in CHANGES.items():
-            for elem in root.iter():
-                if elem.text and old in elem.text:
-                    elem.text = elem.text.replace(old, new)
-                    log.append(f"Replaced '{old}' with '{new}' in {file_path}.")
-                    content_updated = True
+            if old in replaced:
+                log.append(f"Replaced '{old}' with '{new}' in {file_path}.")
 
         # Add missing attributes
-        for attr, value in REQUIRED_ATTRIBUTES.items():
+        for attr, template in _REQUIRED_ELEMENTS.items():
             if root.find(f".//{attr}") is None:
-                new_element = ET.fromstring(value)
+                new_element = copy.deepcopy(template)
                 root.append(new_element)
                 log.append(f"Added missing attribute '{attr}' in {file_path}.")
                 content_updated = True
@@ -158,17 +408,17 @@ def update_about_xml(root_dir, log):
         return
 
     try:
-        tree = ET.parse(about_file_path)
+        tree = _parse_xml(about_file_path)
         root = tree.getroot()
 
-        supported_versions = root.find(".//supportedVersions")
+        # supportedVersions is a direct child of <ModMetaData>, so no descendant search is needed
+        supported_versions = root.find("supportedVersions")
         if supported_versions is None:
-            supported_versions = ET.SubElement(root, "supportedVersions")
+            supported_versions = etree.SubElement(root, "supportedVersions")
             log.append("<supportedVersions> tag created.")
 
-        versions = [li.text for li in supported_versions.findall("li")]
-        if "1.5" not in versions:
-            new_version = ET.Element("li")
+        if not any(li.tag == "li" and li.text == "1.5" for li in supported_versions):
+            new_version = etree.Element("li")
             new_version.text = "1.5"
             supported_versions.append(new_version)
             log.append("Added RimWorld 1.5 to <supportedVersions> in About.xml.")
@@ -177,58 +427,72 @@ def update_about_xml(root_dir, log):
     except Exception as e:
         log.append(f"Failed to update About.xml: {e}")
 
+def copy_and_update_tree(src_dir, dest_dir, log):
+    """
+    Recreate src_dir as dest_dir in a single pass: XML files are updated on the way,
+    every other file is linked or copied without being read.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    with os.scandir(src_dir) as entries:
+        for entry in entries:
+            dest_path = os.path.join(dest_dir, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                copy_and_update_tree(entry.path, dest_path, log)
+            elif entry.is_dir():
+                # Following a symlinked directory could loop forever
+                log.append(f"Skipped symlinked directory: {entry.path}")
+            elif entry.name.endswith(".xml"):
+                apply_changes_with_refined_formatting(dest_path, log, source_path=entry.path)
+            else:
+                link_or_copy(entry.path, dest_path)
+
 def preprocess_and_update_full_backup(root_dir, version_from, version_to):
     """
     Update a mod from version 1.4 to 1.5 with integrated backup and results packaging.
     """
     src_dir = os.path.join(root_dir, version_from)
     dest_dir = os.path.join(root_dir, version_to)
-    log = []
+    log_file = os.path.join(root_dir, f"{version_to}_update_log.txt")
+    log = _Log(log_file)
+    backup_thread = None
 
     try:
         # Step 1: Create the initial backup if it doesn't exist
         log.append("Checking for initial backup...")
         create_initial_backup(root_dir, log)
 
-        # Step 2: Create an incremental backup
+        # Step 2: Create an incremental backup in the background. It only reads 1.4 and About,
+        # which step 3 leaves untouched, and the log is safe to append to from both threads.
         log.append("Creating an incremental backup...")
-        create_incremental_zip(root_dir, ["1.4", "About"], "backup", log)
-
-        # Step 3: Preprocess files in the source directory
-        log.append("Preprocessing XML files in the source directory...")
-        for root, _, files in os.walk(src_dir):
-            for file in files:
-                if file.endswith(".xml"):
-                    file_path = os.path.join(root, file)
-                    validate_and_repair(file_path, log)
-
-        log.append("Preprocessing completed.")
-
-        # Step 4: Copy files to the destination directory
-        shutil.copytree(src_dir, dest_dir, dirs_exist_ok=True)
+        backup_thread = threading.Thread(
+            target=create_incremental_zip,
+            args=(root_dir, ["1.4", "About"], "backup", log),
+            kwargs={"delta": True},
+        )
+        backup_thread.start()
+
+        # Step 3: Copy files to the destination directory, applying updates to XML files on
+        # the way. Only the copies are validated and repaired, so the source files are never
+        # modified; backup.zip is the safety net.
+        copy_and_update_tree(src_dir, dest_dir, log)
         log.append(f"Copied files from '{src_dir}' to '{dest_dir}'.")
 
-        # Step 5: Apply updates to the copied files
-        for root, _, files in os.walk(dest_dir):
-            for file in files:
-                if file.endswith(".xml"):
-                    apply_changes_with_refined_formatting(os.path.join(root, file), log)
-
-        # Step 6: Update About.xml
+        # Step 4: Update About.xml once the backup has finished reading it
+        backup_thread.join()
         update_about_xml(root_dir, log)
 
-        # Step 7: Create a results zip
+        # Step 5: Create a results zip
         log.append("Creating results package...")
-        create_incremental_zip(root_dir, ["1.4", "About", version_to, f"{version_to}_update_log.txt"], "results", log)
+        create_incremental_zip(root_dir, ["1.4", "About", version_to, os.path.basename(log_file)], "results", log, compresslevel=6)
 
         log.append("Update and packaging completed successfully.")
     except Exception as e:
         log.append(f"Error during update: {e}")
         shutil.rmtree(dest_dir, ignore_errors=True)
     finally:
-        log_file = os.path.join(root_dir, f"{version_to}_update_log.txt")
-        with open(log_file, "w", encoding="utf-8") as log_out:
-            log_out.write("\n".join(log))
+        if backup_thread is not None:
+            backup_thread.join()
+        log.close()
 
 if __name__ == "__main__":
     ROOT_DIR = os.getcwd()